@@ -1,43 +1,107 @@
 # cache_ma.py
-import shelve
+import dbm
+import glob
+import json
 import os
+import shelve
+import sqlite3
+import unicodedata
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
-CACHE_FILE = "ma_cache.db"
+# SQLite is used (instead of shelve) as cache is shared by all worker processes when running with --workers
+CACHE_FILE = "ma_cache.sqlite"
+LEGACY_CACHE_FILE = "ma_cache.db"  # shelve cache used by previous versions
 DAYS_TO_EXPIRE = 15
 
+@contextmanager
+def _open_cache():
+    connection = sqlite3.connect(CACHE_FILE, timeout=30)
+    try:
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cache (cache_key TEXT PRIMARY KEY, timestamp TEXT, data TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS shared_state (name TEXT PRIMARY KEY, value TEXT)")
+            yield connection
+    finally:
+        connection.close()
+
+def normalize_text(text):
+    # Used to build cache/index keys, so "Iron Maiden ", "iron maiden" or "IRON  MAIDEN" are the same search
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+def _get_expiration_timestamp():
+    return (datetime.now() - timedelta(days = DAYS_TO_EXPIRE)).isoformat()
+
 def save_in_cache(cache_key, cache_key_value):
-    with shelve.open(CACHE_FILE, writeback=True) as cache:
-        cache[cache_key] = {
-            "timestamp": datetime.now().isoformat(),
-            "data": cache_key_value
-        }
+    with _open_cache() as cache:
+        cache.execute(
+            "INSERT OR REPLACE INTO cache (cache_key, timestamp, data) VALUES (?, ?, ?)",
+            (cache_key, datetime.now().isoformat(), json.dumps(cache_key_value, ensure_ascii=False))
+        )
 
 def get_data_from_cache(cache_key):
-    with shelve.open(CACHE_FILE) as cache:
-        item = cache.get(cache_key)
-        if not item:
-            return None
-        cache_key_date = datetime.fromisoformat(item["timestamp"])
-        if datetime.now() - cache_key_date > timedelta(days = DAYS_TO_EXPIRE):
-            print(f"🧹 Expired Cache for key: {cache_key}")
-            delete_from_cache(cache_key)
-            return None
-        print(f"📦 Valid Cache for key: {cache_key}")
-        return item["data"]
+    with _open_cache() as cache:
+        item = cache.execute("SELECT timestamp, data FROM cache WHERE cache_key = ?", (cache_key,)).fetchone()
+    if not item:
+        return None
+    if item[0] < _get_expiration_timestamp():
+        print(f"🧹 Expired Cache for key: {cache_key}")
+        delete_from_cache(cache_key)
+        return None
+    print(f"📦 Valid Cache for key: {cache_key}")
+    return json.loads(item[1])
 
 def delete_from_cache(cache_key):
-    with shelve.open(CACHE_FILE, writeback=True) as cache:
-        if cache_key in cache:
-            del cache[cache_key]
+    with _open_cache() as cache:
+        cache.execute("DELETE FROM cache WHERE cache_key = ?", (cache_key,))
 
 def cleanup_expired_cache():
-    with shelve.open(CACHE_FILE, writeback=True) as cache:
-        cache_keys_to_delete = []
-        for cache_key, item in cache.items():
-            fecha = datetime.fromisoformat(item.get("timestamp", "1970-01-01T00:00:00"))
-            if datetime.now() - fecha > timedelta(days = DAYS_TO_EXPIRE):
-                cache_keys_to_delete.append(cache_key)
+    expiration_timestamp = _get_expiration_timestamp()
+    with _open_cache() as cache:
+        cache_keys_to_delete = [row[0] for row in cache.execute("SELECT cache_key FROM cache WHERE timestamp < ?", (expiration_timestamp,))]
         for cache_key in cache_keys_to_delete:
             print(f"🧹 Cleaning up expired Cache: {cache_key}")
-            del cache[cache_key]
\ No newline at end of file
+        cache.execute("DELETE FROM cache WHERE timestamp < ?", (expiration_timestamp,))
+
+# Shared state is not cached data (it doesn't expire), but it's stored in the same file so all worker processes see the same values
+def get_shared_state(name, default=None):
+    with _open_cache() as cache:
+        item = cache.execute("SELECT value FROM shared_state WHERE name = ?", (name,)).fetchone()
+    return json.loads(item[0]) if item else default
+
+def save_shared_state(name, value):
+    with _open_cache() as cache:
+        cache.execute("INSERT OR REPLACE INTO shared_state (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+def clear_shared_state():
+    with _open_cache() as cache:
+        cache.execute("DELETE FROM shared_state")
+
+def migrate_legacy_cache():
+    # Not expired entries of the shelve cache are copied once (keeping their timestamps), then its files are renamed to *.migrated
+    if not dbm.whichdb(LEGACY_CACHE_FILE):
+        return 0
+    expiration_timestamp = _get_expiration_timestamp()
+    migrated = 0
+    with shelve.open(LEGACY_CACHE_FILE, flag="r") as legacy_cache, _open_cache() as cache:
+        for cache_key in legacy_cache.keys():
+            try:
+                item = legacy_cache[cache_key]
+                if item.get("timestamp", "") < expiration_timestamp:
+                    continue
+                cache.execute(
+                    "INSERT OR IGNORE INTO cache (cache_key, timestamp, data) VALUES (?, ?, ?)",
+                    (cache_key, item["timestamp"], json.dumps(item["data"], ensure_ascii=False))
+                )
+                migrated += 1
+            except Exception as e:
+                print(f"⚠️ Couldn't migrate Cache for key: {cache_key} ({e})")
+    for legacy_file in glob.glob(glob.escape(LEGACY_CACHE_FILE) + "*"):
+        if not legacy_file.endswith(".migrated"):
+            os.replace(legacy_file, legacy_file + ".migrated")
+    print(f"📦 {migrated} entries migrated from previous Cache ({LEGACY_CACHE_FILE})")
+    return migrated
+
+def get_all_from_cache():
+    with _open_cache() as cache:
+        return {row[0]: json.loads(row[1]) for row in cache.execute("SELECT cache_key, data FROM cache WHERE timestamp >= ?", (_get_expiration_timestamp(),))}
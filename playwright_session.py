@@ -1,6 +1,14 @@
-import threading
 import time
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+
+from cache_ma import get_shared_state, save_shared_state
+from resource_policy import ResourcePolicy
+
+class CloudflareChallengeError(Exception):
+    pass
+
+class CircuitOpenError(Exception):
+    pass
 
 class PlaywrightSessionManager:
     _playwright = None
@@ -8,36 +16,39 @@ class PlaywrightSessionManager:
     _context = None
     _page = None
     _last_used = time.time()
-    _monitor_thread = None
     _inactivity_limit = 900  # seconds (15 minutes)
 
+    # Recovery steps applied, in order, after a failed attempt (each one is heavier than the previous one)
+    _recovery_steps = ["retry", "page", "context", "browser"]
+    _job_time_budget = 90  # seconds, no more recovery steps are tried once exceeded (all jobs share a single thread)
+    _recovery_backoff = 2  # seconds, waited before the first recovery step and doubled on every following one
+
+    # Circuit breaker used to stop hitting Metal Archives while a Cloudflare challenge is being served.
+    # Its state is shared by all worker processes (see get_shared_state), as all of them are seen as the same client
+    _circuit_cooldown = 60  # seconds, doubled on every consecutive challenge
+    _circuit_max_cooldown = 900  # seconds (15 minutes)
+
     @classmethod
     def start(cls):
         if cls._playwright is None:
             print("🟢 Starting new Playwright session...")
             cls._playwright = sync_playwright().start()
             cls._browser = cls._playwright.firefox.launch(headless=True)
-            cls._context = cls._browser.new_context()
-            cls._context.set_default_timeout(15000)
-
-            # To block resources in a selective way to make execution "a little bit" lightweight (and try to not break Cloudflare)
-            cls._context.route("**/*", lambda route, request: cls._handle_route(route, request))
-
-            cls._page = cls._context.new_page()
-            cls._start_monitor()
+            cls._new_context()
         else:
             print("🔄 Reusing Playwright existing session.")
         cls._last_used = time.time()
         return cls._page
 
     @classmethod
-    def _handle_route(cls, route, request):
-        url = request.url
-        tipo = request.resource_type
-        if tipo in ["image", "stylesheet", "font"] or "google-analytics" in url or "doubleclick" in url:
-            route.abort()
-        else:
-            route.continue_()
+    def _new_context(cls):
+        cls._context = cls._browser.new_context()
+        cls._context.set_default_timeout(15000)
+
+        # To block resources in a selective way to make execution "a little bit" lightweight (and try to not break Cloudflare)
+        ResourcePolicy.apply(cls._context)
+
+        cls._page = cls._context.new_page()
 
     @classmethod
     def get_page(cls, new=False):
@@ -52,17 +63,142 @@ class PlaywrightSessionManager:
             return cls._page
 
     @classmethod
-    def _start_monitor(cls):
-        if cls._monitor_thread is None:
-            def monitor():
-                while True:
-                    time.sleep(60)
-                    if cls._playwright and time.time() - cls._last_used > cls._inactivity_limit:
-                        print("⏳ Inactivity detected. Closing Playwright existing session...")
-                        cls.close()
-                        break
-            cls._monitor_thread = threading.Thread(target=monitor, daemon=True)
-            cls._monitor_thread.start()
+    def run(cls, task, description="request", acquire=None):
+        # Executes task(page), escalating recovery on every failure instead of tearing down the whole browser:
+        # retry on the same page -> recycle the page -> recreate the context -> relaunch the browser
+        # acquire() is called before every attempt, as each one is a new request to Metal Archives (see UpstreamScheduler)
+        cls._check_circuit()
+
+        job_start_time = time.time()
+        last_exception = None
+        for attempt, step in enumerate([None] + cls._recovery_steps):
+            if step:
+                backoff = cls._recovery_backoff * 2 ** (attempt - 1)
+                if time.time() - job_start_time + backoff > cls._job_time_budget:
+                    print(f"⌛ {description} exceeded its time budget of {cls._job_time_budget} seconds.")
+                    break
+                time.sleep(backoff)
+                try:
+                    cls._recover(step)
+                except Exception as e:
+                    print(f"⚠️ Error while applying recovery step '{step}': {e}")
+                    last_exception = e
+                    continue
+
+            if acquire:
+                acquire()
+            page = None
+            loaded = False
+            ResourcePolicy.begin_measure()
+            start_time = time.time()
+            try:
+                page = cls.get_page()
+                result = task(page)
+                loaded = True
+                cls._close_circuit()
+                return result
+            except CloudflareChallengeError:
+                cls._open_circuit()
+                raise
+            except Exception as e:
+                last_exception = e
+                if page is not None and cls.is_challenge_page(page):
+                    cls._open_circuit()
+                    raise CloudflareChallengeError("Cloudflare challenge detected") from e
+                print(f"⚠️ Error on {description}: {e}")
+                if not cls._is_recoverable(e):
+                    # Retrying won't help (e.g. AJAX response not found for current search)
+                    raise
+            finally:
+                # Failed attempts are reported as well, as those are usually the slowest/heaviest ones
+                ResourcePolicy.end_measure(description, time.time() - start_time, loaded)
+
+        print(f"❌ {description} failed after recovery steps.")
+        raise last_exception
+
+    @classmethod
+    def _is_recoverable(cls, exception):
+        # Only navigation errors, timeouts, and closed pages/contexts/browsers are worth a recovery step
+        if isinstance(exception, PlaywrightTimeoutError):
+            return True
+        if isinstance(exception, PlaywrightError):
+            message = str(exception)
+            return any(error in message for error in ["has been closed", "Target closed", "NS_ERROR", "net::", "Navigation"])
+        return False
+
+    @classmethod
+    def _recover(cls, step):
+        if step == "retry":
+            print("🔁 Retrying on the same page...")
+        elif step == "page":
+            print("♻️ Recycling main page...")
+            try:
+                if cls._page:
+                    cls._page.close()
+            except Exception as e:
+                print(f"⚠️ Error while closing page: {e}")
+            cls._page = cls._context.new_page()
+        elif step == "context":
+            print("♻️ Recreating browser context...")
+            try:
+                if cls._context:
+                    cls._context.close()
+            except Exception as e:
+                print(f"⚠️ Error while closing context: {e}")
+            cls._new_context()
+        elif step == "browser":
+            print("♻️ Relaunching browser...")
+            cls._shutdown()
+            cls.start()
+
+    @classmethod
+    def is_challenge_page(cls, page):
+        try:
+            page_title = page.title()
+            if "Just a moment" in page_title or "Checking your browser" in page_title:
+                print("🛑 Cloudflare Challenge detected on Title")
+                return True
+
+            if page.query_selector("#cf-spinner") or page.query_selector("form#challenge-form"):
+                print("🛑 Cloudflare Challenge detected in DOM")
+                return True
+        except Exception:
+            # Page could be closed or navigating, so it can't be checked
+            pass
+        return False
+
+    @classmethod
+    def raise_if_challenged(cls, page):
+        if cls.is_challenge_page(page):
+            raise CloudflareChallengeError("Cloudflare challenge detected")
+
+    @classmethod
+    def _check_circuit(cls):
+        remaining = get_shared_state("circuit_open_until", 0) - time.time()
+        if remaining > 0:
+            raise CircuitOpenError(f"Metal Archives is serving a Cloudflare challenge. Requests paused for {int(remaining)} more seconds")
+
+    @classmethod
+    def _open_circuit(cls):
+        consecutive_challenges = get_shared_state("consecutive_challenges", 0) + 1
+        cooldown = min(cls._circuit_cooldown * 2 ** (consecutive_challenges - 1), cls._circuit_max_cooldown)
+        save_shared_state("consecutive_challenges", consecutive_challenges)
+        save_shared_state("circuit_open_until", time.time() + cooldown)
+        print(f"⛔ Circuit opened for {cooldown} seconds (challenge #{consecutive_challenges})")
+
+    @classmethod
+    def _close_circuit(cls):
+        if get_shared_state("consecutive_challenges", 0):
+            print("✅ Circuit closed. Metal Archives is reachable again.")
+            save_shared_state("consecutive_challenges", 0)
+            save_shared_state("circuit_open_until", 0)
+
+    @classmethod
+    def close_if_inactive(cls):
+        # Called periodically by the thread that owns the session (see UpstreamScheduler)
+        if cls._playwright and time.time() - cls._last_used > cls._inactivity_limit:
+            print("⏳ Inactivity detected. Closing Playwright existing session...")
+            cls.close()
 
     @classmethod
     def is_active(cls):
@@ -70,7 +206,7 @@ class PlaywrightSessionManager:
         return cls._playwright is not None and cls._browser is not None and cls._context is not None
 
     @classmethod
-    def close(cls):
+    def _shutdown(cls):
         try:
             if cls._context:
                 cls._context.close()
@@ -88,5 +224,8 @@ class PlaywrightSessionManager:
             print("⚠️ Error while closing Playwright")
 
         cls._playwright = cls._browser = cls._context = cls._page = None
-        cls._monitor_thread = None
-        print("🔴 Playwright session closed.")
\ No newline at end of file
+
+    @classmethod
+    def close(cls):
+        cls._shutdown()
+        print("🔴 Playwright session closed.")
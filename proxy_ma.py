@@ -1,3 +1,5 @@
+import argparse
+import itertools
 import json
 import logging
 import re
@@ -5,18 +7,26 @@ import signal
 import sys
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from playwright.sync_api import sync_playwright
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, parse_qs, quote
 from pathlib import Path
 
 from playwright_session import PlaywrightSessionManager
-from cache_ma import save_in_cache, get_data_from_cache, cleanup_expired_cache
+from upstream_scheduler import UpstreamScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from cache_ma import save_in_cache, get_data_from_cache, get_all_from_cache, cleanup_expired_cache, clear_shared_state, migrate_legacy_cache, normalize_text
+from search_index import init_index, is_index_empty, index_albums, index_bands, search_albums_in_index, search_bands_in_index, mark_search_complete, is_search_complete
+from worker_pool import WorkerPool
 
 PORT = 5000
 
+# Searches are requested to Metal Archives in pages (DataTables' iDisplayStart/iDisplayLength)
+SEARCH_PAGE_SIZE = 200
+SEARCH_MAX_PAGES = 25
+
 def get_base_dir():
     if getattr(sys, 'frozen', False):
         return Path(sys.executable).parent
@@ -50,40 +60,49 @@ class MAProxyHandler(BaseHTTPRequestHandler):
         params = parse_qs(parsed.query)
         path = parsed.path
 
+        # Batch/prefetch clients can send "priority=background" to let interactive lookups go first
+        if params.get("priority", [""])[0] == "background":
+            UpstreamScheduler.set_priority(PRIORITY_BACKGROUND)
+        else:
+            UpstreamScheduler.set_priority(PRIORITY_INTERACTIVE)
+
+        # Searches can be answered from local index ("local"), Metal Archives ("upstream"), or local index falling through to Metal Archives ("auto")
+        source = params.get("source", ["auto"])[0]
+
         if path == "/search":
             artist = params.get("artist", [""])[0]
             album = params.get("album", [""])[0]
-            result = search_albums(artist, album)
-            self._send_json(result)
+            pages = iterate_search_pages(search_album_rows, artist, album, source, on_complete=lambda: mark_search_complete("albums", artist, album))
+            self._send_search_results(pages, lambda rows: render_album_rows(rows, "album"))
         elif path == "/search_artist":
             artist = params.get("artist", [""])[0]
-            result = search_artists(artist)
-            self._send_json(result)
+            pages = iterate_search_pages(search_artist_rows, artist, source, on_complete=lambda: mark_search_complete("bands", artist))
+            self._send_search_results(pages, render_band_rows)
         elif path == "/search_full":
             artist = params.get("artist", [""])[0]
             album = params.get("album", [""])[0]
-            result = search_albums_with_info(artist, album)
-            self._send_json(result)
+            pages = iterate_search_pages(search_album_rows, artist, album, source, on_complete=lambda: mark_search_complete("albums", artist, album))
+            self._send_search_results(pages, lambda rows: render_album_rows(rows, "album_full"))
         elif path == "/album":
             url = params.get("url", [""])[0]
             if not url:
                 self._send_json({"error": "Missing parameter: 'url'"}) #, code = 400)
                 return
-            result = get_album(url)
+            result = dispatch(get_album, url)
             self._send_json(result)
         elif path == "/album_full":
             url = params.get("url", [""])[0]
             if not url:
                 self._send_json({"error": "Missing parameter: 'url'"}) #, code = 400)
                 return
-            result = get_album_with_artist_info(url)
+            result = dispatch(get_album_with_artist_info, url)
             self._send_json(result)
         elif path == "/artist_info":
             url = params.get("url", [""])[0]
             if not url:
                 self._send_json({"error": "Missing parameter: 'url'"}) #, code = 400)
                 return
-            result = get_artist_info(url)
+            result = dispatch(get_artist_info, url)
             self._send_json(result)
         else:
             if path != "/favicon.ico":
@@ -97,9 +116,128 @@ class MAProxyHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(response)
 
-def search_albums(artist, album):
+    def _send_search_results(self, pages, render_rows):
+        first_page = next(pages)
+        if "error" in first_page:
+            self._send_json(first_page)
+            return
+        page_size, total = get_search_window(first_page)
+        if first_page.get("local") or first_page["total"] <= page_size:
+            self._send_json({"results": render_rows(first_page["rows"])})
+            return
+
+        # Results with more than one page are streamed as each page arrives (without Content-Length, the response ends when connection is closed)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"results": [')
+
+        error = None
+        is_first_result = True
+        for page in itertools.chain([first_page], pages):
+            if "error" in page:
+                error = page["error"]
+                break
+            for result in render_rows(page["rows"]):
+                if not is_first_result:
+                    self.wfile.write(b", ")
+                self.wfile.write(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+                is_first_result = False
+            self.wfile.flush()
+
+        if error:
+            self.wfile.write(b'], "error": ' + json.dumps(error, ensure_ascii=False).encode("utf-8") + b"}")
+        elif total < first_page["total"]:
+            self.wfile.write(b'], "truncated": true}')
+        else:
+            self.wfile.write(b"]}")
+
+def dispatch(function, *args):
+    # In supervisor mode (--workers), scraping and parsing are done by worker processes, each one with its own browser
+    if not WorkerPool.is_active():
+        return function(*args)
+    try:
+        return WorkerPool.run(function, *args, priority=UpstreamScheduler.get_priority())
+    except Exception as e:
+        return {"error": str(e)}
+
+def iterate_search_pages(function, *args, on_complete=None):
+    # Yields every page of a search (function(*args, start)) in order, as soon as each one is available.
+    # Pages after the first one are fetched in parallel when running with --workers.
+    # on_complete() is called once all the results from Metal Archives were received (i.e. without errors, nor truncated)
+    first_page = dispatch(function, *args, 0)
+    if "error" in first_page or first_page.get("local"):
+        yield first_page
+        return
+
+    page_size, total = get_search_window(first_page)
+    if total <= page_size:
+        # Only one page, so the caller won't resume this generator after getting it (search is already complete)
+        if on_complete:
+            on_complete()
+        yield first_page
+        return
+
+    yield first_page
+    if total < first_page["total"]:
+        message = f"Search truncated to {total} of {first_page['total']} results (SEARCH_MAX_PAGES = {SEARCH_MAX_PAGES})"
+        print(f"✂️ {message}")
+        logging.info(message)
+    priority = UpstreamScheduler.get_priority()
+
+    def get_page(start):
+        UpstreamScheduler.set_priority(priority)
+        return dispatch(function, *args, start)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, WorkerPool.get_workers()))
+    try:
+        futures = [executor.submit(get_page, start) for start in range(page_size, total, page_size)]
+        for future in futures:
+            page = future.result()
+            yield page
+            if "error" in page:
+                return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if on_complete and total == first_page["total"]:
+        on_complete()
+
+def get_search_window(first_page):
+    # Rows per page served by Metal Archives (which could be less than requested), and results to be requested (up to SEARCH_MAX_PAGES pages).
+    # Page size is taken from the raw response, as some rows could be skipped while parsing
+    page_size = first_page.get("page_size") or SEARCH_PAGE_SIZE
+    return page_size, min(first_page["total"], page_size * SEARCH_MAX_PAGES)
+
+def render_album_rows(rows, link_path):
+    results = []
+    for row in rows:
+        results.append({
+            "artist": row["artist"],
+            "album": row["album"],
+            "metal_archives_album_url": f"http://localhost:{PORT}/{link_path}?url={quote(row['album_url'])}",
+            "metal_archives_type": row["type"],
+            "year": row["year"]
+        })
+    return results
+
+def render_band_rows(rows):
+    results = []
+    for row in rows:
+        results.append({
+            "artist": row["artist"],
+            "artist_genres": row["genres"],
+            "metal_archives_artist_url": f"http://localhost:{PORT}/artist_info?url={quote(row['band_url'])}",
+            "country": row["country"]
+        })
+    return results
+
+def search_album_rows(artist, album, source="auto", start=0):
+    # Shared by /search and /search_full, so both use the same upstream request and cache entry (links to the Proxy are added by each endpoint)
+    artist = artist.strip()
+    album = album.strip()
     base_url = "https://www.metal-archives.com/search/ajax-advanced/searching/albums/"
-    query_params = "?releaseYearFrom=0001&releaseYearTo=9999&sEcho=1&iColumns=4&exactBandMatch=1"
+    query_params = f"?releaseYearFrom=0001&releaseYearTo=9999&sEcho=1&iColumns=4&iDisplayStart={start}&iDisplayLength={SEARCH_PAGE_SIZE}&exactBandMatch=1"
     if artist and album:
         query_params += f"&bandName={quote(artist)}&releaseTitle={quote(album)}"
     elif artist:
@@ -110,38 +248,28 @@ def search_albums(artist, album):
         return {"error": "Missing required values: 'artist' or 'album'"}
 
     full_url = base_url + query_params
-    cache_key = f"search:{artist}|{album}"
+    cache_key = f"search_rows:{normalize_text(artist)}|{normalize_text(album)}|{start}"
     cached = get_data_from_cache(cache_key)
     if cached:
         print(f"✅ Cache found for current search: {cache_key}")
         return cached
 
-    try:
-        page = PlaywrightSessionManager.start()
-        response_data = {}
-
-        def handle_response(response):
-            if "ajax-advanced/searching/albums" in response.url and response.status == 200:
-                try:
-                    json_data = response.json()
-                    response_data.update(json_data)
-                except:
-                    pass
+    local_rows = search_albums_locally(artist, album, source) if start == 0 else None
+    if local_rows is not None:
+        return {"rows": local_rows, "total": len(local_rows), "local": True}
 
-        page.on("response", handle_response)
-        page.goto(full_url, wait_until="domcontentloaded", timeout=60000)
-        page.wait_for_timeout(3000)
-
-        if not response_data or "aaData" not in response_data:
-            return {"error": "Couldn't capture AJAX response"}
+    try:
+        response_data = UpstreamScheduler.submit(lambda page: fetch_ajax_json(page, full_url, "ajax-advanced/searching/albums"), "album search")
 
-        results = []
+        rows = []
         for row in response_data["aaData"]:
             if len(row) < 4:
                 continue
 
             artist_html = row[0]
             artist_text = re.sub(r"<.*?>", "", artist_html).strip()
+            match_band = re.search(r'href="([^"]+)"', artist_html)
+            band_url = match_band.group(1) if match_band else ""
 
             album_html = row[1]
             match = re.search(r'href="([^"]+)">([^<]+)', album_html)
@@ -153,26 +281,28 @@ def search_albums(artist, album):
             match_date = re.search(r'<!--\s*(\d{4}-\d{2}-\d{2})\s*-->', release_date_raw)
             release_year = match_date.group(1) if match_date else release_date_raw.strip()
 
-            results.append({
+            rows.append({
+                "album_url": album_url,
+                "band_url": band_url,
                 "artist": artist_text,
                 "album": album_title,
-                "metal_archives_album_url": f"http://localhost:{PORT}/album?url={quote(album_url)}",
-                "metal_archives_type": release_type,
+                "type": release_type,
                 "year": release_year
             })
 
-        save_in_cache(cache_key, {"results": results})
+        search_data = {"rows": rows, "total": int(response_data.get("iTotalRecords", len(rows))), "page_size": len(response_data["aaData"])}
+        save_in_cache(cache_key, search_data)
+        index_albums(rows)
 
         debug_path_search = debug_dir / "debug_mp3tag_output_search.txt"
         with open(debug_path_search, "w", encoding="utf-8") as log_file:
             log_file.write("🔍 Used Metal Archives URL:\n")
             log_file.write(full_url + "\n\n")
-            log_file.write("📦 Data sent to Mp3tag:\n")
-            log_file.write(json.dumps({"results": results}, indent=2, ensure_ascii=False))
+            log_file.write("📦 Data parsed from Metal Archives:\n")
+            log_file.write(json.dumps(search_data, indent=2, ensure_ascii=False))
 
-        return {"results": results}
+        return search_data
     except Exception as e:
-        PlaywrightSessionManager.close()
         return {"error": str(e)}
 
 def get_album(url):
@@ -188,9 +318,7 @@ def get_album(url):
         html_path = debug_dir / f"debug_album_html.html"
         log_path = log_dir / f"debug_album_log.txt"
 
-        page = PlaywrightSessionManager.get_page()
-        page.goto(url, wait_until="domcontentloaded", timeout=60000)
-        html = page.content()
+        html = UpstreamScheduler.submit(lambda page: fetch_html(page, url), "album page")
 
         with open(html_path, "w", encoding="utf-8") as log_file:
             log_file.write(html)
@@ -273,6 +401,7 @@ def get_album(url):
                             log_file.write(f"  ⚠️ {result_key} contains Unicode\n")
 
         save_in_cache(cache_key, result)
+        index_album_data(result)
 
         debug_path_album = debug_dir / "debug_mp3tag_output_album.txt"
         with open(debug_path_album, "w", encoding="utf-8") as log_file:
@@ -283,12 +412,12 @@ def get_album(url):
 
         return result
     except Exception as e:
-        PlaywrightSessionManager.close()
         return {"error": str(e)}
 
-def search_artists(artist):
+def search_artist_rows(artist, source="auto", start=0):
+    artist = artist.strip()
     base_url = "https://www.metal-archives.com/search/ajax-advanced/searching/bands/"
-    query_params = "?genre=&country=&yearCreationFrom=&yearCreationTo=&bandNotes=&status=&themes=&location=&bandLabelName=&sEcho=1&iColumns=3&sColumns=&iDisplayStart=0&iDisplayLength=200&exactBandMatch=1"
+    query_params = f"?genre=&country=&yearCreationFrom=&yearCreationTo=&bandNotes=&status=&themes=&location=&bandLabelName=&sEcho=1&iColumns=3&sColumns=&iDisplayStart={start}&iDisplayLength={SEARCH_PAGE_SIZE}&exactBandMatch=1"
     if artist:
         query_params += f"&bandName={quote(artist)}"
     else:
@@ -296,33 +425,20 @@ def search_artists(artist):
 
     full_url = base_url + query_params
 
-    cache_key = f"search:{artist}|info"
+    cache_key = f"search_bands:{normalize_text(artist)}|{start}"
     cached = get_data_from_cache(cache_key)
     if cached:
         print(f"✅ Cache found for current search: {cache_key}")
         return cached
 
+    local_rows = search_artists_locally(artist, source) if start == 0 else None
+    if local_rows is not None:
+        return {"rows": local_rows, "total": len(local_rows), "local": True}
+
     try:
-        page = PlaywrightSessionManager.start()
-        response_data = {}
-
-        def handle_response(response):
-            if "ajax-advanced/searching/bands" in response.url and response.status == 200:
-                try:
-                    json_data = response.json()
-                    response_data.update(json_data)
-                except:
-                    pass
-
-        page.on("response", handle_response)
-        page.goto(full_url, wait_until="domcontentloaded", timeout=60000)
-        page.wait_for_timeout(3000)
-
-        if not response_data or "aaData" not in response_data:
-            # PlaywrightSessionManager.close()
-            return {"error": "Couldn't capture AJAX response"}
-
-        results = []
+        response_data = UpstreamScheduler.submit(lambda page: fetch_ajax_json(page, full_url, "ajax-advanced/searching/bands"), "band search")
+
+        rows = []
         for row in response_data["aaData"]:
             # if len(row) < 4:
             #     continue
@@ -335,25 +451,26 @@ def search_artists(artist):
             artist_genres = row[1].strip()
             artist_country = row[2].strip()
 
-            results.append({
+            rows.append({
+                "band_url": artist_url,
                 "artist": artist_name,
-                "artist_genres": artist_genres,
-                "metal_archives_artist_url": f"http://localhost:{PORT}/artist_info?url={quote(artist_url)}",
+                "genres": artist_genres,
                 "country": artist_country
             })
 
-        save_in_cache(cache_key, {"results": results})
+        search_data = {"rows": rows, "total": int(response_data.get("iTotalRecords", len(rows))), "page_size": len(response_data["aaData"])}
+        save_in_cache(cache_key, search_data)
+        index_bands(rows)
 
         debug_path_search = debug_dir / "debug_mp3tag_output_search.txt"
         with open(debug_path_search, "w", encoding="utf-8") as log_file:
             log_file.write("🔍 Used Metal Archives URL:\n")
             log_file.write(full_url + "\n\n")
-            log_file.write("📦 Data sent to Mp3tag:\n")
-            log_file.write(json.dumps({"results": results}, indent=2, ensure_ascii=False))
+            log_file.write("📦 Data parsed from Metal Archives:\n")
+            log_file.write(json.dumps(search_data, indent=2, ensure_ascii=False))
 
-        return {"results": results}
+        return search_data
     except Exception as e:
-        PlaywrightSessionManager.close()
         return {"error": str(e)}
 
 def get_artist_info(url):
@@ -369,9 +486,7 @@ def get_artist_info(url):
         html_path = debug_dir / "debug_band_html.html"
         log_path = debug_dir / "debug_band_log.txt"
 
-        page = PlaywrightSessionManager.get_page()
-        page.goto(url, wait_until="domcontentloaded", timeout=60000)
-        html = page.content()
+        html = UpstreamScheduler.submit(lambda page: fetch_html(page, url), "band page")
 
         with open(html_path, "w", encoding="utf-8") as log_file:
             log_file.write(html)
@@ -389,6 +504,7 @@ def get_artist_info(url):
 
         result = {
             "metal_archives_band_url": url,
+            "artist": get_text("h1.band_name"),
             "country": get_dd_text("Country of origin:"),
             "metal_archives_location": get_dd_text("Location:"),
             "metal_archives_status": get_dd_text("Status:"),
@@ -411,90 +527,10 @@ def get_artist_info(url):
             log_file.write(json.dumps({"results": result}, indent=2, ensure_ascii=False))
 
         save_in_cache(cache_key, result)
+        index_band_data(result)
         return result
 
     except Exception as e:
-        PlaywrightSessionManager.close()
-        return {"error": str(e)}
-
-def search_albums_with_info(artist, album):
-    base_url = "https://www.metal-archives.com/search/ajax-advanced/searching/albums/"
-    query_params = "?releaseYearFrom=0001&releaseYearTo=9999&sEcho=1&iColumns=4&exactBandMatch=1"
-    if artist and album:
-        query_params += f"&bandName={quote(artist)}&releaseTitle={quote(album)}"
-    elif artist:
-        query_params += f"&bandName={quote(artist)}"
-    elif album:
-        query_params += f"&releaseTitle={quote(album)}"
-    else:
-        return {"error": "Missing required values: 'artist' or 'album'"}
-
-    full_url = base_url + query_params
-
-    cache_key = f"search_full:{artist}|{album}"
-    cached = get_data_from_cache(cache_key)
-    if cached:
-        print(f"✅ Cache found for current search: {cache_key}")
-        return cached
-
-    try:
-        page = PlaywrightSessionManager.start()
-        response_data = {}
-
-        def handle_response(response):
-            if "ajax-advanced/searching/albums" in response.url and response.status == 200:
-                try:
-                    json_data = response.json()
-                    response_data.update(json_data)
-                except:
-                    pass
-
-        page.on("response", handle_response)
-        page.goto(full_url, wait_until="domcontentloaded", timeout=60000)
-        page.wait_for_timeout(3000)
-
-        if not response_data or "aaData" not in response_data:
-            # PlaywrightSessionManager.close()
-            return {"error": "Couldn't capture AJAX response"}
-
-        results = []
-        for row in response_data["aaData"]:
-            if len(row) < 4:
-                continue
-
-            artist_html = row[0]
-            artist_text = re.sub(r"<.*?>", "", artist_html).strip()
-
-            album_html = row[1]
-            match = re.search(r'href="([^"]+)">([^<]+)', album_html)
-            album_url = match.group(1) if match else ""
-            album_title = match.group(2) if match else ""
-
-            release_type = row[2].strip()
-            release_date_raw = row[3]
-            match_date = re.search(r'<!--\s*(\d{4}-\d{2}-\d{2})\s*-->', release_date_raw)
-            release_year = match_date.group(1) if match_date else release_date_raw.strip()
-
-            results.append({
-                "artist": artist_text,
-                "album": album_title,
-                "metal_archives_album_url": f"http://localhost:{PORT}/album_full?url={quote(album_url)}",
-                "metal_archives_type": release_type,
-                "year": release_year
-            })
-
-        save_in_cache(cache_key, {"results": results})
-
-        debug_path_search = debug_dir / "debug_mp3tag_output_search.txt"
-        with open(debug_path_search, "w", encoding="utf-8") as log_file:
-            log_file.write("🔍 Usedd Metal Archives URL:\n")
-            log_file.write(full_url + "\n\n")
-            log_file.write("📦 Data sent to Mp3tag:\n")
-            log_file.write(json.dumps({"results": results}, indent=2, ensure_ascii=False))
-
-        return {"results": results}
-    except Exception as e:
-        PlaywrightSessionManager.close()
         return {"error": str(e)}
 
 def get_album_with_artist_info(url):
@@ -552,9 +588,128 @@ def get_album_with_artist_info(url):
         return result
 
     except Exception as e:
-        PlaywrightSessionManager.close()
         return {"error": str(e)}
 
+def search_albums_locally(artist, album, source):
+    # On "auto", local results are only used when they are known to be complete: the same search (or the band's whole discography)
+    # was fully received from Metal Archives before. On "local", whatever is indexed is used (results could be incomplete)
+    if source == "local" or (source == "auto" and is_album_search_complete(artist, album)):
+        rows = search_albums_in_index(artist, album)
+        print(f"⚡ Local index search for '{artist}|{album}': {len(rows)} results")
+        return [{
+            "album_url": row["album_url"],
+            "band_url": row["band_url"],
+            "artist": row["artist"],
+            "album": row["album"],
+            "type": row["type"],
+            "year": row["year"]
+        } for row in rows]
+    return None
+
+def is_album_search_complete(artist, album):
+    return is_search_complete("albums", artist, album) or bool(artist and album and is_search_complete("albums", artist))
+
+def search_artists_locally(artist, source):
+    if source == "local" or (source == "auto" and is_search_complete("bands", artist)):
+        rows = search_bands_in_index(artist)
+        print(f"⚡ Local index search for '{artist}': {len(rows)} results")
+        return [{
+            "band_url": row["band_url"],
+            "artist": row["artist"],
+            "genres": row["genres"],
+            "country": row["country"]
+        } for row in rows]
+    return None
+
+def index_album_data(album_data):
+    index_albums([{
+        "album_url": album_data.get("metal_archives_album_url", ""),
+        "band_url": album_data.get("metal_archives_band_url", ""),
+        "artist": album_data.get("artist", ""),
+        "album": album_data.get("album", ""),
+        "type": album_data.get("metal_archives_type", ""),
+        "year": album_data.get("metal_archives_date", "") or album_data.get("year", "")
+    }])
+    index_bands([{
+        "band_url": album_data.get("metal_archives_band_url", ""),
+        "artist": album_data.get("artist", "")
+    }])
+
+def index_band_data(band_data):
+    index_bands([{
+        "band_url": band_data.get("metal_archives_band_url", ""),
+        "artist": band_data.get("artist", ""),
+        "genres": band_data.get("genre", ""),
+        "country": band_data.get("country", "")
+    }])
+
+def get_url_from_proxy_link(proxy_link):
+    return parse_qs(urlparse(proxy_link).query).get("url", [""])[0]
+
+def build_index_from_cache():
+    print("🗂️ Building local search index from cache...")
+    for cache_key, data in get_all_from_cache().items():
+        if cache_key.startswith("album:"):
+            index_album_data(data)
+        elif cache_key.startswith("album_with_artist:"):
+            index_album_data(data.get("album_data", {}))
+            index_band_data(data.get("artist_data", {}))
+        elif cache_key.startswith("band:"):
+            index_band_data(data)
+        elif cache_key.startswith("search_rows:"):
+            index_albums(data.get("rows", []))
+        elif cache_key.startswith("search_bands:"):
+            index_bands(data.get("rows", []))
+        elif cache_key.startswith(("search:", "search_full:")):
+            for row in data.get("results", []):
+                if "metal_archives_artist_url" in row:
+                    index_bands([{
+                        "band_url": get_url_from_proxy_link(row["metal_archives_artist_url"]),
+                        "artist": row.get("artist", ""),
+                        "genres": row.get("artist_genres", ""),
+                        "country": row.get("country", "")
+                    }])
+                elif "metal_archives_album_url" in row:
+                    index_albums([{
+                        "album_url": get_url_from_proxy_link(row["metal_archives_album_url"]),
+                        "artist": row.get("artist", ""),
+                        "album": row.get("album", ""),
+                        "type": row.get("metal_archives_type", ""),
+                        "year": row.get("year", "")
+                    }])
+
+def fetch_ajax_json(page, url, url_fragment):
+    response_data = {}
+
+    def handle_response(response):
+        if url_fragment in response.url and response.status == 200:
+            try:
+                json_data = response.json()
+                response_data.update(json_data)
+            except:
+                pass
+
+    page.on("response", handle_response)
+    try:
+        page.goto(url, wait_until="domcontentloaded", timeout=60000)
+        # Waits up to 3 seconds for the AJAX response (e.g. after a Cloudflare redirect), but no longer than needed
+        waited_time = 0
+        while "aaData" not in response_data and waited_time < 3000:
+            page.wait_for_timeout(100)
+            waited_time += 100
+    finally:
+        page.remove_listener("response", handle_response)
+
+    if not response_data or "aaData" not in response_data:
+        raise Exception("Couldn't capture AJAX response")
+
+    return response_data
+
+def fetch_html(page, url):
+    page.goto(url, wait_until="domcontentloaded", timeout=60000)
+    PlaywrightSessionManager.raise_if_challenged(page)
+    return page.content()
+
 def format_date(release_date_raw):
     months = {
         "January": "01", "February": "02", "March": "03", "April": "04",
@@ -612,10 +767,13 @@ def extract_addtional_info(parsed_html):
     final_text = re.sub(r"[^\S\r\n]{2,}", " ", final_text)
     return final_text.strip()
 
+def load_home_page(page):
+    page.goto("https://www.metal-archives.com/", wait_until="domcontentloaded", timeout=10000)
+    PlaywrightSessionManager.raise_if_challenged(page)
+
 def preload_proxy():
     try:
-        page = PlaywrightSessionManager.get_page(new=True)
-        page.goto("https://www.metal-archives.com/", wait_until="domcontentloaded", timeout=10000)
+        UpstreamScheduler.submit(load_home_page, "preload", PRIORITY_BACKGROUND)
         print("🔥 Proxy Preloaded with Metal Archives Home Page")
     except Exception as e:
         print(f"⚠️ Error while preloading: {e}")
@@ -624,20 +782,10 @@ def preload_with_validation(retries = 3, wait_between_retries = 5):
     for attempt in range(1, retries + 1):
         try:
             print(f"🚀 Preload attempt {attempt}...")
-            page = PlaywrightSessionManager.get_page(new=True)
             start_time = time.time()
-            page.goto("https://www.metal-archives.com/", wait_until="domcontentloaded", timeout=10000)
+            UpstreamScheduler.submit(load_home_page, "preload", PRIORITY_BACKGROUND)
             elapsed_time = time.time() - start_time
 
-            page_title = page.title()
-            if "Just a moment" in page_title or "Checking your browser" in page_title:
-                print("🛑 Cloudflare Challenge detected on Title")
-                raise Exception("Cloudflare challenge")
-
-            if page.query_selector("#cf-spinner") or page.query_selector("form#challenge-form"):
-                print("🛑 Cloudflare Challenge detected in DOM")
-                raise Exception("Cloudflare DOM challenge")
-
             print(f"✅ Success! Preload completed in {elapsed_time:.2f} seconds")
             return True
 
@@ -650,16 +798,36 @@ def preload_with_validation(retries = 3, wait_between_retries = 5):
                 print("❌ Preload couldn't be completed. Proxy could be blocked by Metal Archives.")
                 return False
             
+def init_worker():
+    if not preload_with_validation():
+        print("⚠️ Worker will start without Preload. There could be errors on first search.")
+
 def graceful_shutdown(signum, frame):
     print("\n🛑 Graceful shutdown triggered")
     server.shutdown()
 
 if __name__ == "__main__":
-    preload_was_successful = preload_with_validation()
-    if not preload_was_successful:
-        print("⚠️ Proxy will start without Preload. There could be errors on first search.")
+    parser = argparse.ArgumentParser(description="Metal Archives proxy for Mp3tag")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes, each one with its own browser (default: 1)")
+    args = parser.parse_args()
+
+    # Circuit breaker and upstream rate of a previous run are not kept
+    clear_shared_state()
+    try:
+        legacy_entries = migrate_legacy_cache()
+    except Exception as e:
+        print(f"⚠️ Error while migrating previous Cache: {e}")
+        legacy_entries = 0
+    if args.workers > 1:
+        WorkerPool.start(args.workers, init_worker)
+    else:
+        preload_was_successful = preload_with_validation()
+        if not preload_was_successful:
+            print("⚠️ Proxy will start without Preload. There could be errors on first search.")
     cleanup_expired_cache()
-    server = HTTPServer(("localhost", PORT), MAProxyHandler)
+    if init_index() and (legacy_entries or is_index_empty()):
+        build_index_from_cache()
+    server = ThreadingHTTPServer(("localhost", PORT), MAProxyHandler)
 
     try:
         print(f"🚀 Proxy MA with Playwright available at http://localhost:{PORT}")
@@ -669,6 +837,6 @@ if __name__ == "__main__":
         signal.signal(signal.SIGINT, graceful_shutdown)
     finally:
         # server.server_close()
-        if PlaywrightSessionManager.is_active():
-            PlaywrightSessionManager.close()
+        WorkerPool.stop()
+        UpstreamScheduler.stop()
         print("✅ Resources correctly released.")
\ No newline at end of file
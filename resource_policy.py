@@ -0,0 +1,99 @@
+import itertools
+import logging
+import re
+import weakref
+
+# Domains allowed to be loaded (Metal Archives itself, and Cloudflare for its challenges)
+ALLOWED_DOMAINS = ["metal-archives.com", "cloudflare.com"]
+
+# Block every request to a domain not listed in ALLOWED_DOMAINS (ads, trackers, 3rd party scripts, etc.)
+BLOCK_OTHER_DOMAINS = True
+
+# Domains always blocked, even when BLOCK_OTHER_DOMAINS is disabled
+BLOCKED_DOMAINS = ["google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com"]
+
+# File extensions never needed to scrape data (images, stylesheets, fonts and media)
+BLOCKED_EXTENSIONS = ["png", "jpg", "jpeg", "gif", "webp", "svg", "ico", "bmp", "css", "woff", "woff2", "ttf", "otf", "eot", "mp3", "mp4", "webm"]
+
+# Resource types blocked by inspecting every request.
+# Leave empty unless needed, as this makes every single request go through Python (patterns above are checked by the browser driver)
+BLOCKED_RESOURCE_TYPES = []
+
+class ResourcePolicy:
+    # Stats of the job being measured (see begin_measure), events from previous jobs arriving late are ignored
+    _job_ids = itertools.count(1)
+    _current_job = None
+    _request_jobs = weakref.WeakKeyDictionary()
+    _blocked = 0
+    _passed = 0
+    _passed_bytes = 0
+
+    @classmethod
+    def apply(cls, context):
+        for pattern in cls._get_blocked_patterns():
+            context.route(pattern, cls._block)
+
+        if BLOCKED_RESOURCE_TYPES:
+            context.route("**/*", cls._handle_route)
+
+        context.on("request", cls._on_request)
+        context.on("response", cls._on_response)
+
+    @classmethod
+    def _get_blocked_patterns(cls):
+        patterns = [re.compile(r"^[^?#]+\.(" + "|".join(BLOCKED_EXTENSIONS) + r")([?#].*)?$", re.IGNORECASE)]
+
+        if BLOCK_OTHER_DOMAINS:
+            allowed = "|".join(re.escape(domain) for domain in ALLOWED_DOMAINS)
+            patterns.append(re.compile(r"^https?://(?!([^/?#]*\.)?(" + allowed + r")(:\d+)?([/?#]|$))", re.IGNORECASE))
+
+        if BLOCKED_DOMAINS:
+            blocked = "|".join(re.escape(domain) for domain in BLOCKED_DOMAINS)
+            patterns.append(re.compile(r"^https?://([^/?#]*\.)?(" + blocked + r")(:\d+)?([/?#]|$)", re.IGNORECASE))
+
+        return patterns
+
+    @classmethod
+    def _block(cls, route, request=None):
+        if cls._current_job is not None:
+            cls._blocked += 1
+        route.abort()
+
+    @classmethod
+    def _handle_route(cls, route, request):
+        if request.resource_type in BLOCKED_RESOURCE_TYPES:
+            cls._block(route)
+        else:
+            route.fallback()
+
+    @classmethod
+    def _on_request(cls, request):
+        if cls._current_job is not None:
+            cls._request_jobs[request] = cls._current_job
+
+    @classmethod
+    def _on_response(cls, response):
+        # Only responses to requests started by the current job are counted
+        if cls._current_job is None or cls._request_jobs.pop(response.request, None) != cls._current_job:
+            return
+        cls._passed += 1
+        # Size is taken from headers (already received with the event) instead of asking the driver for it.
+        # Responses without Content-Length (e.g. chunked) are counted, but not their size
+        try:
+            cls._passed_bytes += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    @classmethod
+    def begin_measure(cls):
+        cls._current_job = next(cls._job_ids)
+        cls._blocked = cls._passed = cls._passed_bytes = 0
+
+    @classmethod
+    def end_measure(cls, description, elapsed_time, loaded=True):
+        cls._current_job = None
+        passed_kb = cls._passed_bytes / 1024
+        result = "loaded" if loaded else "failed"
+        message = f"{description}: {cls._passed} requests passed ({passed_kb:.1f} KB), {cls._blocked} blocked, {result} in {elapsed_time:.2f} seconds"
+        print(f"📊 {message}")
+        logging.info(message)
@@ -0,0 +1,222 @@
+# search_index.py
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from cache_ma import DAYS_TO_EXPIRE, normalize_text
+
+INDEX_FILE = "ma_search_index.db"
+
+_index_available = True
+
+@contextmanager
+def _open_index():
+    connection = sqlite3.connect(INDEX_FILE, timeout=10)
+    connection.row_factory = sqlite3.Row
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def init_index():
+    global _index_available
+    try:
+        with _open_index() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS albums (
+                    id INTEGER PRIMARY KEY,
+                    album_url TEXT UNIQUE,
+                    band_url TEXT,
+                    artist TEXT,
+                    artist_key TEXT,
+                    album TEXT,
+                    type TEXT,
+                    year TEXT,
+                    timestamp TEXT
+                );
+                CREATE INDEX IF NOT EXISTS albums_artist_key ON albums (artist_key);
+                CREATE VIRTUAL TABLE IF NOT EXISTS albums_fts USING fts5(
+                    artist, album, content='albums', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS albums_ai AFTER INSERT ON albums BEGIN
+                    INSERT INTO albums_fts (rowid, artist, album) VALUES (new.id, new.artist, new.album);
+                END;
+                CREATE TRIGGER IF NOT EXISTS albums_ad AFTER DELETE ON albums BEGIN
+                    INSERT INTO albums_fts (albums_fts, rowid, artist, album) VALUES ('delete', old.id, old.artist, old.album);
+                END;
+                CREATE TRIGGER IF NOT EXISTS albums_au AFTER UPDATE ON albums BEGIN
+                    INSERT INTO albums_fts (albums_fts, rowid, artist, album) VALUES ('delete', old.id, old.artist, old.album);
+                    INSERT INTO albums_fts (rowid, artist, album) VALUES (new.id, new.artist, new.album);
+                END;
+
+                CREATE TABLE IF NOT EXISTS bands (
+                    band_url TEXT PRIMARY KEY,
+                    artist TEXT,
+                    artist_key TEXT,
+                    genres TEXT,
+                    country TEXT,
+                    timestamp TEXT
+                );
+                CREATE INDEX IF NOT EXISTS bands_artist_key ON bands (artist_key);
+
+                CREATE TABLE IF NOT EXISTS complete_searches (
+                    search_key TEXT PRIMARY KEY,
+                    timestamp TEXT
+                );
+            """)
+    except sqlite3.Error as e:
+        print(f"⚠️ Local search index not available: {e}")
+        _index_available = False
+    return _index_available
+
+def is_index_empty():
+    if not _index_available:
+        return False
+    try:
+        with _open_index() as connection:
+            return connection.execute("SELECT COUNT(*) FROM albums").fetchone()[0] == 0 and connection.execute("SELECT COUNT(*) FROM bands").fetchone()[0] == 0
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while reading local search index: {e}")
+        return False
+
+def index_albums(rows):
+    # rows: dicts with "album_url", "band_url", "artist", "album", "type" and "year" (empty values don't overwrite indexed ones)
+    if not _index_available or not rows:
+        return
+    timestamp = datetime.now().isoformat()
+    try:
+        with _open_index() as connection:
+            connection.executemany("""
+                INSERT INTO albums (album_url, band_url, artist, artist_key, album, type, year, timestamp)
+                VALUES (:album_url, :band_url, :artist, :artist_key, :album, :type, :year, :timestamp)
+                ON CONFLICT (album_url) DO UPDATE SET
+                    band_url = COALESCE(NULLIF(excluded.band_url, ''), band_url),
+                    artist = COALESCE(NULLIF(excluded.artist, ''), artist),
+                    artist_key = COALESCE(NULLIF(excluded.artist_key, ''), artist_key),
+                    album = COALESCE(NULLIF(excluded.album, ''), album),
+                    type = COALESCE(NULLIF(excluded.type, ''), type),
+                    year = COALESCE(NULLIF(excluded.year, ''), year),
+                    timestamp = excluded.timestamp
+            """, [{
+                "album_url": row.get("album_url", ""),
+                "band_url": row.get("band_url", ""),
+                "artist": row.get("artist", ""),
+                "artist_key": normalize_text(row.get("artist", "")),
+                "album": row.get("album", ""),
+                "type": row.get("type", ""),
+                "year": row.get("year", ""),
+                "timestamp": timestamp
+            } for row in rows if row.get("album_url")])
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while updating local search index: {e}")
+
+def index_bands(rows):
+    # rows: dicts with "band_url", "artist", "genres" and "country" (empty values don't overwrite indexed ones)
+    # Rows without artist (e.g. band pages cached by older versions) only update already indexed bands, as they couldn't be found by name
+    if not _index_available or not rows:
+        return
+    timestamp = datetime.now().isoformat()
+    rows = [{
+        "band_url": row.get("band_url", ""),
+        "artist": row.get("artist", ""),
+        "artist_key": normalize_text(row.get("artist", "")),
+        "genres": row.get("genres", ""),
+        "country": row.get("country", ""),
+        "timestamp": timestamp
+    } for row in rows if row.get("band_url")]
+    try:
+        with _open_index() as connection:
+            connection.executemany("""
+                UPDATE bands SET
+                    genres = COALESCE(NULLIF(:genres, ''), genres),
+                    country = COALESCE(NULLIF(:country, ''), country),
+                    timestamp = :timestamp
+                WHERE band_url = :band_url
+            """, [row for row in rows if not row["artist_key"]])
+            connection.executemany("""
+                INSERT INTO bands (band_url, artist, artist_key, genres, country, timestamp)
+                VALUES (:band_url, :artist, :artist_key, :genres, :country, :timestamp)
+                ON CONFLICT (band_url) DO UPDATE SET
+                    artist = COALESCE(NULLIF(excluded.artist, ''), artist),
+                    artist_key = COALESCE(NULLIF(excluded.artist_key, ''), artist_key),
+                    genres = COALESCE(NULLIF(excluded.genres, ''), genres),
+                    country = COALESCE(NULLIF(excluded.country, ''), country),
+                    timestamp = excluded.timestamp
+            """, [row for row in rows if row["artist_key"]])
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while updating local search index: {e}")
+
+def search_albums_in_index(artist, album):
+    if not _index_available:
+        return []
+    query = "SELECT albums.* FROM albums"
+    conditions = ["albums.timestamp >= ?"]
+    values = [_get_expiration_timestamp()]
+
+    album_terms = _get_fts_terms(album)
+    if album_terms:
+        query += " JOIN albums_fts ON albums_fts.rowid = albums.id"
+        conditions.append("albums_fts MATCH ?")
+        values.append(" AND ".join(f"album : {term}" for term in album_terms))
+    if artist:
+        conditions.append("albums.artist_key = ?")
+        values.append(normalize_text(artist))
+
+    query += " WHERE " + " AND ".join(conditions) + " ORDER BY albums.artist, albums.year"
+    try:
+        with _open_index() as connection:
+            return [dict(row) for row in connection.execute(query, values)]
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while reading local search index: {e}")
+        return []
+
+def search_bands_in_index(artist):
+    if not _index_available:
+        return []
+    try:
+        with _open_index() as connection:
+            return [dict(row) for row in connection.execute(
+                "SELECT * FROM bands WHERE artist_key = ? AND timestamp >= ? ORDER BY artist",
+                (normalize_text(artist), _get_expiration_timestamp())
+            )]
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while reading local search index: {e}")
+        return []
+
+def mark_search_complete(kind, artist, album=""):
+    # Every result of this search (all pages, from Metal Archives) is indexed, so it can be answered locally while not expired
+    if not _index_available:
+        return
+    try:
+        with _open_index() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO complete_searches (search_key, timestamp) VALUES (?, ?)",
+                (_get_search_key(kind, artist, album), datetime.now().isoformat())
+            )
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while updating local search index: {e}")
+
+def is_search_complete(kind, artist, album=""):
+    if not _index_available:
+        return False
+    try:
+        with _open_index() as connection:
+            return connection.execute(
+                "SELECT 1 FROM complete_searches WHERE search_key = ? AND timestamp >= ?",
+                (_get_search_key(kind, artist, album), _get_expiration_timestamp())
+            ).fetchone() is not None
+    except sqlite3.Error as e:
+        print(f"⚠️ Error while reading local search index: {e}")
+        return False
+
+def _get_search_key(kind, artist, album):
+    return f"{kind}:{normalize_text(artist)}|{normalize_text(album)}"
+
+def _get_fts_terms(text):
+    # Every word is quoted, so user input can't be interpreted as FTS5 syntax
+    return ['"' + word + '"' for word in re.findall(r"\w+", normalize_text(text))]
+
+def _get_expiration_timestamp():
+    return (datetime.now() - timedelta(days = DAYS_TO_EXPIRE)).isoformat()
@@ -0,0 +1,160 @@
+import itertools
+import queue
+import threading
+import time
+
+from cache_ma import get_shared_state, save_shared_state
+from playwright_session import PlaywrightSessionManager, CloudflareChallengeError, CircuitOpenError
+
+PRIORITY_INTERACTIVE = 0  # Mp3tag searches and album/band lookups
+PRIORITY_BACKGROUND = 1  # Preload, prefetch, batch and refresh jobs
+
+class UpstreamScheduler:
+    # All Metal Archives traffic goes through a single worker thread, which also owns the Playwright session
+    # (Playwright's sync API can only be used from the thread that started it)
+    _queue = queue.PriorityQueue()
+    _counter = itertools.count()
+    _worker_thread = None
+    _local = threading.local()
+    _lock = threading.Lock()
+
+    # Token bucket, with rate adapted on the fly (halved on every challenge, slowly increased on every success).
+    # Rate is shared by all worker processes (see get_shared_state), and each one uses its own part of it (see configure)
+    _max_rate = 1.0  # requests per second (safe limit)
+    _min_rate = 0.1  # requests per second
+    _rate_increase = 0.05  # requests per second, added on every successful request
+    _burst = 3
+    _rate_share = 1
+    _rate = _max_rate
+    _tokens = _burst
+    _last_refill = time.time()
+
+    _job_timeout = 600  # seconds, a job not answered by then (waiting on queue included) is cancelled
+
+    @classmethod
+    def submit(cls, task, description="request", priority=None):
+        if priority is None:
+            priority = cls.get_priority()
+        cls._start_worker()
+
+        job = {"task": task, "description": description, "done": threading.Event(), "result": None, "error": None, "cancelled": False}
+        cls._queue.put((priority, next(cls._counter), job))
+        if not job["done"].wait(cls._job_timeout):
+            job["cancelled"] = True
+            raise TimeoutError(f"{description} wasn't answered in {cls._job_timeout} seconds")
+
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    @classmethod
+    def configure(cls, rate_share):
+        # Part of the upstream rate (and burst) used by this process, so all worker processes together stay under the safe limit
+        cls._rate_share = rate_share
+        cls._burst = max(1, round(cls._burst * rate_share))
+        cls._tokens = min(cls._tokens, cls._burst)
+
+    @classmethod
+    def set_priority(cls, priority):
+        # Default priority for jobs submitted from the current thread (i.e. current HTTP request)
+        cls._local.priority = priority
+
+    @classmethod
+    def get_priority(cls):
+        return getattr(cls._local, "priority", PRIORITY_INTERACTIVE)
+
+    @classmethod
+    def stop(cls):
+        if cls._worker_thread is not None:
+            cls._queue.put((-1, next(cls._counter), None))
+            cls._worker_thread.join()
+            cls._worker_thread = None
+
+    @classmethod
+    def _start_worker(cls):
+        with cls._lock:
+            if cls._worker_thread is None or not cls._worker_thread.is_alive():
+                cls._worker_thread = threading.Thread(target=cls._worker, daemon=True)
+                cls._worker_thread.start()
+
+    @classmethod
+    def _worker(cls):
+        # Any error out of a job (e.g. shared state locked) is only logged, as nobody else would answer queued jobs
+        while True:
+            try:
+                if not cls._run_next_job():
+                    break
+            except Exception as e:
+                print(f"⚠️ Error on upstream scheduler: {e}")
+                time.sleep(1)
+
+    @classmethod
+    def _run_next_job(cls):
+        cls._wait_for_token()
+        try:
+            priority, _, job = cls._queue.get(timeout=60)
+        except queue.Empty:
+            PlaywrightSessionManager.close_if_inactive()
+            return True
+
+        if job is None:
+            if PlaywrightSessionManager.is_active():
+                PlaywrightSessionManager.close()
+            return False
+        if job["cancelled"]:
+            return True
+
+        challenged = False
+        try:
+            job["result"] = PlaywrightSessionManager.run(job["task"], job["description"], cls._acquire_token)
+        except CircuitOpenError as e:
+            # Nothing was sent to Metal Archives
+            job["error"] = e
+        except CloudflareChallengeError as e:
+            job["error"] = e
+            challenged = True
+        except Exception as e:
+            job["error"] = e
+        finally:
+            job["done"].set()
+
+        # Rate is adapted once the job is answered, so an error while doing it doesn't change the job's result
+        if challenged:
+            cls._on_challenge()
+        elif job["error"] is None:
+            cls._on_success()
+        return True
+
+    @classmethod
+    def _refill(cls):
+        now = time.time()
+        cls._tokens = min(cls._burst, cls._tokens + (now - cls._last_refill) * cls._rate * cls._rate_share)
+        cls._last_refill = now
+
+    @classmethod
+    def _wait_for_token(cls):
+        cls._rate = get_shared_state("upstream_rate", cls._max_rate)
+        cls._refill()
+        while cls._tokens < 1:
+            time.sleep((1 - cls._tokens) / (cls._rate * cls._rate_share))
+            cls._refill()
+
+    @classmethod
+    def _acquire_token(cls):
+        # One token per attempt, so recovery retries are rate limited as well
+        cls._wait_for_token()
+        cls._tokens -= 1
+
+    @classmethod
+    def _on_success(cls):
+        rate = get_shared_state("upstream_rate", cls._max_rate)
+        if rate < cls._max_rate:
+            cls._rate = min(cls._max_rate, rate + cls._rate_increase)
+            save_shared_state("upstream_rate", cls._rate)
+
+    @classmethod
+    def _on_challenge(cls):
+        cls._rate = max(cls._min_rate, get_shared_state("upstream_rate", cls._max_rate) / 2)
+        save_shared_state("upstream_rate", cls._rate)
+        cls._tokens = min(cls._tokens, 0)
+        print(f"🐢 Challenge detected. Upstream rate lowered to {cls._rate:.2f} requests/second")
@@ -0,0 +1,103 @@
+import heapq
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from upstream_scheduler import UpstreamScheduler, PRIORITY_INTERACTIVE
+
+def _run_job(function, args, priority):
+    # Executed on a worker process, which has its own UpstreamScheduler and Playwright session
+    UpstreamScheduler.set_priority(priority)
+    return function(*args)
+
+def _init_worker(workers, initializer):
+    # Upstream rate limit is shared between all workers, so all of them together stay under the safe limit
+    UpstreamScheduler.configure(1 / workers)
+    if initializer:
+        initializer()
+
+def _wait_for_workers(barrier):
+    # Keeps the worker busy until all of them are running, so every warm-up job is run (and initialized) on a different worker
+    barrier.wait()
+
+class WorkerPool:
+    _executor = None
+    _workers = 0
+    _initializer = None
+    _free_workers = 0
+    _waiting = []  # heap of (priority, order) of jobs waiting for a free worker
+    _counter = itertools.count()
+    _condition = threading.Condition()
+
+    @classmethod
+    def start(cls, workers, initializer=None):
+        cls._workers = workers
+        cls._initializer = initializer
+        cls._free_workers = workers
+        cls._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(workers, initializer))
+        cls._warm_up(cls._executor)
+        print(f"👷 Worker pool started with {workers} workers")
+
+    @classmethod
+    def _warm_up(cls, executor):
+        # Worker processes are only created (and initialized, e.g. preloaded) when jobs are submitted,
+        # so one job per worker is run on start, instead of delaying the first lookups of each worker
+        print(f"👷 Starting {cls._workers} workers...")
+        try:
+            with multiprocessing.Manager() as manager:
+                barrier = manager.Barrier(cls._workers)
+                futures = [executor.submit(_wait_for_workers, barrier) for _ in range(cls._workers)]
+                for future in futures:
+                    future.result()
+        except Exception as e:
+            print(f"⚠️ Error while starting workers: {e}")
+
+    @classmethod
+    def is_active(cls):
+        return cls._executor is not None
+
+    @classmethod
+    def get_workers(cls):
+        return cls._workers if cls._executor is not None else 0
+
+    @classmethod
+    def run(cls, function, *args, priority=PRIORITY_INTERACTIVE):
+        # Jobs are handed to workers in priority order (and in arrival order within the same priority)
+        ticket = (priority, next(cls._counter))
+        with cls._condition:
+            heapq.heappush(cls._waiting, ticket)
+            while cls._free_workers == 0 or cls._waiting[0] != ticket:
+                cls._condition.wait()
+            heapq.heappop(cls._waiting)
+            cls._free_workers -= 1
+            cls._condition.notify_all()
+
+        executor = cls._executor
+        try:
+            return executor.submit(_run_job, function, args, priority).result()
+        except BrokenProcessPool:
+            cls._restart(executor)
+            raise
+        finally:
+            with cls._condition:
+                cls._free_workers += 1
+                cls._condition.notify_all()
+
+    @classmethod
+    def _restart(cls, broken_executor):
+        with cls._condition:
+            # Another job could have restarted it already
+            if cls._executor is not broken_executor:
+                return
+            print("⚠️ A worker process died unexpectedly. Restarting worker pool...")
+            cls._executor = ProcessPoolExecutor(max_workers=cls._workers, initializer=_init_worker, initargs=(cls._workers, cls._initializer))
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def stop(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True, cancel_futures=True)
+            cls._executor = None
+            print("👷 Worker pool stopped")